@@ -2,38 +2,226 @@
 Command line tool to commit changes to a file using AI-generated commit messages.
 """
 import os
+import re
+import sys
 import json
-import tempfile
+import hashlib
+import asyncio
+import time
+import threading
+from functools import lru_cache
 from pathlib import Path
 import click
-from git import Repo
-import openai
+
+CACHE_DIR = Path.home() / ".cache/gpt-commit"
+MODELS_CACHE_TTL = 24 * 60 * 60  # seconds
+MODELS_PAGE_LIMIT = 100
+
+MAX_FILE_DIFF_CHARS = 1000
+DIFF_OPTIONS = {"ignore_all_space": True, "diff_algorithm": "minimal", "function_context": True}
+_FILE_HEADER_RE = re.compile(r"^(?=diff --git )", re.MULTILINE)
+_HUNK_HEADER_RE = re.compile(r"^(?=@@ )", re.MULTILINE)
+_SKIPPED_PATH_RE = re.compile(r"(package-lock\.json|yarn\.lock|\.min\.js)$")
+_TRUNCATED_MARKER = "\u2026truncated\u2026\n"
+COMMIT_PROMPT = "Please write a brief commit message for the following diff:\n{diff}"
+BATCH_MAX_CHARS = 12000  # preprocessed diff text per batched request
+
+LOCAL_BASE_MODEL = "unsloth/LFM2-350M-unsloth-bnb-4bit"
+
+HTTP_MAX_CONNECTIONS = 16
+
+# shared OpenAI clients keyed by (api_key, base_url), each with the event loop it was made on
+_CLIENTS = {}
+# clients replaced because their event loop changed, closed by close_clients()
+_STALE_CLIENTS = []
+
+
+async def close_clients():
+    """
+    Close the shared OpenAI clients and their connection pools.
+    """
+    clients = [client for _, client in _CLIENTS.values()] + _STALE_CLIENTS
+    _CLIENTS.clear()
+    _STALE_CLIENTS.clear()
+    for client in clients:
+        try:
+            await client.close()
+        except (RuntimeError, OSError):
+            # pools made on an already closed loop cannot be shut down cleanly
+            pass
+
+
+def _run(coro):
+    """
+    Run a coroutine to completion, closing the shared clients afterwards.
+    """
+    async def _main():
+        try:
+            return await coro
+        finally:
+            await close_clients()
+    return asyncio.run(_main())
+
+def _truncate_middle(text, budget):
+    """
+    Keep about budget characters from the start and end of text with a
+    truncation marker between. Cuts fall on line boundaries where that
+    keeps most of the budget; a line longer than that is cut mid-line.
+    """
+    half = budget // 2
+    head, tail = text[:half], text[len(text) - half:]
+    newline = head.rfind("\n")
+    if newline >= half // 2:
+        head = head[:newline + 1]
+    elif not head.endswith("\n"):
+        head += "\n"
+    newline = tail.find("\n")
+    if 0 <= newline < half // 2:
+        tail = tail[newline + 1:]
+    return head + _TRUNCATED_MARKER + tail
+
+
+@lru_cache(maxsize=4)
+def _load_secrets(path, _mtime):
+    """
+    Read (api_key, base_url) from a secrets file. Memoized per path and
+    mtime (used only as part of the cache key), so the file is parsed once
+    per process unless it changes.
+    """
+    secrets = json.loads(Path(path).read_bytes())
+    return secrets.get("CBORG_API_KEY"), secrets.get("CBORG_BASE_URL")
+
+
+class LocalLLM:
+    """
+    Commit message generator backed by a small 4-bit quantized model running
+    locally, optionally with a LoRA adapter. Weights are loaded on first use.
+    """
+
+    def __init__(self, base_model=LOCAL_BASE_MODEL, adapter_id=None, max_new_tokens=64):
+        self.base_model = base_model
+        self.adapter_id = adapter_id
+        self.max_new_tokens = max_new_tokens
+        self._model = None
+        self._tokenizer = None
+        self._load_error = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """
+        Load the quantized base model, tokenizer and adapter. Any failure is
+        reported as a RuntimeError and remembered, so later calls fail fast
+        instead of retrying the load.
+        """
+        if self._load_error is not None:
+            raise self._load_error
+        try:
+            import torch
+            from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+
+            quant_config = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.float16,
+            )
+            tokenizer = AutoTokenizer.from_pretrained(self.base_model)
+            model = AutoModelForCausalLM.from_pretrained(
+                self.base_model, quantization_config=quant_config, device_map="auto"
+            )
+            if self.adapter_id:
+                from peft import PeftModel
+                model = PeftModel.from_pretrained(model, self.adapter_id)
+        except ImportError as e:
+            # also raised by from_pretrained when bitsandbytes or accelerate is missing
+            self._load_error = RuntimeError(
+                f"Local mode requires the 'local' extra: pip install 'gpt-commit[local]' ({e})"
+            )
+        except (OSError, ValueError, RuntimeError) as e:
+            self._load_error = RuntimeError(f"Could not load local model '{self.base_model}': {e}")
+        if self._load_error is not None:
+            raise self._load_error
+        model.eval()
+        self._tokenizer = tokenizer
+        self._model = model
+
+    def generate(self, diff_msg):
+        """
+        Generate a commit message for the diff. Blocking; safe to call from threads.
+        """
+        with self._lock:
+            if self._model is None:
+                self._load()
+            messages = [{"role": "user", "content": COMMIT_PROMPT.format(diff=diff_msg)}]
+            inputs = self._tokenizer.apply_chat_template(
+                messages, add_generation_prompt=True, return_tensors="pt"
+            ).to(self._model.device)
+            output = self._model.generate(
+                inputs, max_new_tokens=self.max_new_tokens, do_sample=False
+            )
+            return self._tokenizer.decode(
+                output[0][inputs.shape[-1]:], skip_special_tokens=True
+            ).strip()
+
 
 class GitCommitHelper:
     """
     Helper class to manage Git operations and OpenAI interactions.
     """
 
-    def __init__(self, api_key=None, base_url=None, secrets_file=None):
+    def __init__(self, api_key=None, base_url=None, secrets_file=None, local=None):
         """
-        Initialize the helper by setting up the OpenAI client and Git repo.
+        Initialize the helper and resolve API credentials. The OpenAI client
+        and Git repo are created on first use, so paths that need neither
+        (e.g. listing cached models) never import openai or GitPython.
+        When a LocalLLM is given, messages are generated locally and no
+        credentials are needed.
         """
         self.api_key = api_key
         self.base_url = base_url
         self.secrets_file = secrets_file or (Path.home() / ".config/cborg/secrets.json")
-        self.client = self._get_client()
-        self.repo = self._get_repo()
+        self.local = local
+        self._repo = None
+        self._tracked = None
+        self._unknown_models = set()
+        self._local_error = None
+        if not local:
+            self._load_credentials()
 
-    def _get_client(self):
+    @property
+    def client(self):
+        """
+        OpenAI client, created on first access and shared (see _get_client).
+        """
+        return self._get_client()
+
+    @property
+    def repo(self):
+        """
+        Git repository of the current working directory, opened on first access.
         """
-        Create an OpenAI client using secrets file or environment variables.
+        if self._repo is None:
+            self._repo = self._get_repo()
+        return self._repo
+
+    @property
+    def tracked(self):
+        """
+        Set of paths tracked in the index, read once and shared by all get_diff calls.
+        """
+        if self._tracked is None:
+            self._tracked = {path for path, _stage in self.repo.index.entries}
+        return self._tracked
+
+    def _load_credentials(self):
+        """
+        Fill in API key and base URL from the secrets file or environment variables.
         """
         if not self.api_key or not self.base_url:
             if self.secrets_file.exists():
-                with open(self.secrets_file, encoding='utf-8') as f:
-                    secrets = json.load(f)
-                self.api_key = secrets.get("CBORG_API_KEY") or os.getenv("CBORG_API_KEY")
-                self.base_url = secrets.get("CBORG_BASE_URL") or os.getenv("CBORG_BASE_URL")
+                api_key, base_url = _load_secrets(str(self.secrets_file),
+                                                  self.secrets_file.stat().st_mtime)
+                self.api_key = api_key or os.getenv("CBORG_API_KEY")
+                self.base_url = base_url or os.getenv("CBORG_BASE_URL")
             else:
                 self.api_key = os.getenv("CBORG_API_KEY")
                 self.base_url = os.getenv("CBORG_BASE_URL")
@@ -41,134 +229,550 @@ class GitCommitHelper:
         if not self.api_key or not self.base_url:
             raise RuntimeError("Missing API credentials for OpenAI/CBORG.")
 
-        return openai.OpenAI(api_key=self.api_key, base_url=self.base_url)
+    def _get_client(self):
+        """
+        Get an OpenAI client for the resolved credentials. Clients, and their
+        connection pools, are shared by all helpers with the same credentials
+        on the same event loop.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        key = (self.api_key, self.base_url)
+        cached = _CLIENTS.get(key)
+        if cached:
+            if cached[0] is loop:
+                return cached[1]
+            _STALE_CLIENTS.append(cached[1])
+
+        import httpx
+        import openai
+        limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                              max_keepalive_connections=HTTP_MAX_CONNECTIONS)
+        client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url,
+                                    http_client=openai.DefaultAsyncHttpxClient(limits=limits))
+        _CLIENTS[key] = (loop, client)
+        return client
 
     def _get_repo(self):
         """
         Get the current working directory's Git repository.
         """
+        from git import Repo
         repo = Repo(Path.cwd())
         if repo.bare:
             raise RuntimeError("Not a valid Git repository.")
         return repo
 
-    def get_models(self):
+    async def get_models(self, refresh=False):
         """
-        Fetch available models from OpenAI client.
+        Fetch available models from OpenAI client, using the on-disk cache
+        when it is fresh and was populated from the same endpoint.
         """
+        cache = CACHE_DIR / "models.json"
+        if not refresh and cache.exists() \
+                and time.time() - cache.stat().st_mtime < MODELS_CACHE_TTL:
+            try:
+                cached = json.loads(cache.read_text(encoding='utf-8'))
+                if cached.get("base_url") == str(self.base_url):
+                    return cached["models"]
+            except (OSError, ValueError, KeyError, AttributeError):
+                pass
+
+        import openai
         try:
-            models = self.client.models.list()
-            return [m.id for m in models.data]
+            models = await self.client.models.list(extra_query={"limit": MODELS_PAGE_LIMIT})
+            ids = [m.id for m in models.data]
         except (openai.OpenAIError, ConnectionError, TimeoutError) as e:
             print(f"Error fetching models: {e}")
             return []
 
-    def generate_commit_message(self, diff_msg, model):
+        if ids:
+            try:
+                cache.parent.mkdir(parents=True, exist_ok=True)
+                cache.write_text(json.dumps({"base_url": str(self.base_url), "models": ids}),
+                                 encoding='utf-8')
+            except OSError as e:
+                print(f"Error caching models: {e}")
+        return ids
+
+    @staticmethod
+    def _preprocess_diff(diff):
+        """
+        Shrink a diff before it goes into the prompt: omit lockfile and minified
+        sections, drop whitespace-only hunks and truncate long per-file sections.
+        """
+        sections = []
+        for section in _FILE_HEADER_RE.split(diff):
+            if not section:
+                continue
+            header, *hunks = _HUNK_HEADER_RE.split(section)
+            first_line = header.split("\n", 1)[0]
+            if _SKIPPED_PATH_RE.search(first_line.rsplit(" b/", 1)[-1]):
+                sections.append(f"{first_line}\n(generated file changes omitted)\n")
+                continue
+
+            hunks = [h for h in hunks if any(
+                line[:1] in "+-" and line[1:].strip()
+                for line in h.splitlines()[1:]
+            )]
+            if not hunks:
+                # binary or whitespace-only changes: the header still names the file
+                sections.append(header)
+                continue
+            body = "".join(hunks)
+
+            if len(header) + len(body) > MAX_FILE_DIFF_CHARS:
+                # the header always survives; the body keeps its start and end
+                budget = max(MAX_FILE_DIFF_CHARS - len(header), MAX_FILE_DIFF_CHARS // 4)
+                body = _truncate_middle(body, budget)
+            sections.append(header + body)
+        return "".join(sections)
+
+    def _message_cache_path(self, diff_msg, model):
+        """
+        Path of the cached commit message for this model and diff.
+        """
+        if self.local:
+            model = f"local:{self.local.base_model}:{self.local.adapter_id}"
+        key = hashlib.sha256(f"{model}\0{diff_msg}".encode('utf-8')).hexdigest()
+        return CACHE_DIR / "msgs" / key
+
+    @staticmethod
+    def _read_cached_message(cache):
+        """
+        Return the cached commit message, or None on a miss.
+        """
+        try:
+            return cache.read_text(encoding='utf-8') or None
+        except OSError:
+            return None
+
+    @staticmethod
+    def _write_cached_message(cache, commit_msg):
+        """
+        Store a generated commit message in the cache.
+        """
+        try:
+            cache.parent.mkdir(parents=True, exist_ok=True)
+            cache.write_text(commit_msg, encoding='utf-8')
+        except OSError as e:
+            print(f"Error caching commit message: {e}")
+
+    async def generate_commit_message(self, diff_msg, model, echo=True):
         """
         Generate commit message from diff using a language model.
+        Messages are cached on disk by model and diff, so an unchanged diff
+        is answered without another model call.
+        """
+        cache = self._message_cache_path(diff_msg, model)
+        commit_msg = self._read_cached_message(cache)
+        if commit_msg:
+            if echo:
+                print(commit_msg)
+            return commit_msg
+
+        commit_msg = await self._request_commit_message(diff_msg, model, echo)
+        if commit_msg:
+            self._write_cached_message(cache, commit_msg)
+        return commit_msg
+
+    async def generate_commit_messages_batch(self, diffs, model, max_concurrency=8):
         """
+        Generate commit messages for several diffs ({filename: diff}) with as
+        few requests as possible. Diffs are packed into batches of up to
+        BATCH_MAX_CHARS, each answered by one JSON-mode request; batches run
+        concurrently. Files missing from a reply fall back to a single request.
+        """
+        if len(diffs) == 1:
+            (filename, diff_msg), = diffs.items()
+            return {filename: await self.generate_commit_message(diff_msg, model, echo=False)}
+
+        messages, pending = {}, {}
+        for filename, diff_msg in diffs.items():
+            cache = self._message_cache_path(diff_msg, model)
+            commit_msg = self._read_cached_message(cache)
+            if commit_msg:
+                messages[filename] = commit_msg
+            else:
+                pending[filename] = (cache, self._preprocess_diff(diff_msg))
+
+        batches, batch, size = [], {}, 0
+        for filename, (_, diff_msg) in pending.items():
+            if batch and size + len(diff_msg) > BATCH_MAX_CHARS:
+                batches.append(batch)
+                batch, size = {}, 0
+            batch[filename] = diff_msg
+            size += len(diff_msg)
+        if batch:
+            batches.append(batch)
+
+        sem = asyncio.Semaphore(max_concurrency)
+
+        async def _one(batch):
+            async with sem:
+                return await self._request_commit_messages_batch(batch, model)
+
+        for replies in await asyncio.gather(*[_one(b) for b in batches]):
+            for filename, commit_msg in replies.items():
+                messages[filename] = commit_msg
+                self._write_cached_message(pending[filename][0], commit_msg)
+
+        missing = [f for f in pending if f not in messages]
+        fallback = await asyncio.gather(*[
+            self.generate_commit_message(diffs[f], model, echo=False) for f in missing
+        ])
+        messages.update(zip(missing, fallback))
+        return messages
+
+    async def _request_commit_messages_batch(self, diffs, model):
+        """
+        Ask the model for one commit message per file in a single JSON-mode
+        request. Returns {filename: message} for the files it answered.
+        """
+        if model in self._unknown_models:
+            return {}
+
+        import openai
+        sections = "".join(f"=== file: {f} ===\n{d}\n" for f, d in diffs.items())
+        try:
+            response = await self.client.chat.completions.create(
+                model=model,
+                messages=[{
+                    "role": "user",
+                    "content": "Please write a brief commit message for each of the "
+                               "following diffs. Return JSON of the form "
+                               '{"messages": [{"file": <file>, "message": <message>}, ...]} '
+                               f"for these diffs:\n{sections}"
+                }],
+                temperature=0.0,
+                response_format={"type": "json_object"}
+            )
+            reply = json.loads(response.choices[0].message.content)
+            entries = reply.get("messages", [])
+            return {
+                e["file"]: e["message"].strip()
+                for e in entries
+                if isinstance(e, dict) and e.get("file") in diffs
+                and isinstance(e.get("message"), str) and e["message"].strip()
+            }
+        except openai.NotFoundError:
+            await self._report_unknown_model(model)
+            return {}
+        except (openai.OpenAIError, ConnectionError, TimeoutError,
+                ValueError, TypeError, AttributeError, IndexError) as e:
+            print(f"Error generating batched commit messages: {e}")
+            return {}
+
+    async def _report_unknown_model(self, model):
+        """
+        Tell the user the requested model does not exist and list the ones
+        that do. Only the first failure per model is reported.
+        """
+        if model in self._unknown_models:
+            return
+        self._unknown_models.add(model)
+        print(f"Model '{model}' is not available. Available models:")
+        for m in await self.get_models():
+            print(f"- {m}")
+
+    async def _request_commit_message(self, diff_msg, model, echo=True):
+        """
+        Ask the model for a commit message. API replies are streamed, and
+        echoed to stdout as they arrive when echo is set.
+        """
+        diff_msg = self._preprocess_diff(diff_msg)
+        if self.local:
+            try:
+                commit_msg = await asyncio.to_thread(self.local.generate, diff_msg)
+            except (RuntimeError, OSError, ValueError) as e:
+                # a failed model load is re-raised for every file; report it once
+                if e is not self._local_error:
+                    self._local_error = e
+                    print(f"Error generating commit message: {e}")
+                return None
+            if echo and commit_msg:
+                print(commit_msg)
+            return commit_msg or None
+
+        if model in self._unknown_models:
+            return None
+
+        import openai
+        chunks = []
+
+        def _end_echo():
+            # terminate the echoed partial message before anything else is printed
+            if echo and chunks:
+                sys.stdout.write("\n")
+                sys.stdout.flush()
+
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=model,
                 messages=[{
                     "role": "user",
-                    "content": f"Please write a brief commit message \
-                         for the following diff:\n{diff_msg}"
+                    "content": COMMIT_PROMPT.format(diff=diff_msg)
                 }],
-                temperature=0.0
+                temperature=0.0,
+                stream=True
             )
-            if response and response.choices:
-                return response.choices[0].message.content.strip()
+            async for event in response:
+                if not event.choices:
+                    continue
+                delta = event.choices[0].delta.content
+                if delta:
+                    if echo:
+                        sys.stdout.write(delta)
+                        sys.stdout.flush()
+                    chunks.append(delta)
+        except openai.NotFoundError:
+            _end_echo()
+            await self._report_unknown_model(model)
+            return None
         except (openai.OpenAIError, ConnectionError, TimeoutError) as e:
+            _end_echo()
             print(f"Error generating commit message: {e}")
-        return None
+            return None
+        _end_echo()
+        return "".join(chunks).strip() or None
 
     def get_diff(self, filename):
         """
         Get the diff for the given filename (unstaged or staged).
         """
-        if filename not in self.repo.git.ls_files().splitlines():
+        if filename not in self.tracked:
             raise FileNotFoundError(f"'{filename}' is not tracked by git.")
 
-        diff_msg = self.repo.git.diff(filename) or self.repo.git.diff('HEAD', filename)
-        return diff_msg
+        # DIFF_OPTIONS ignore whitespace, which hides indentation-only edits;
+        # fall back to a plain diff so such files can still be committed
+        for options in (DIFF_OPTIONS, {}):
+            diff_msg = (self._format_patch(self.repo.index.diff(None, paths=[filename],
+                                                                create_patch=True, **options))
+                        or (self.repo.head.is_valid() and self._format_patch(
+                            self.repo.head.commit.diff(None, paths=[filename],
+                                                       create_patch=True, **options))))
+            if diff_msg:
+                return diff_msg
+        return ""
 
-    def stage_and_commit(self, filename, commit_message):
+    @staticmethod
+    def _format_patch(diffs):
+        """
+        Render GitPython Diff objects as unified diff text with file headers,
+        including mode, new/deleted file and rename lines, so metadata-only
+        changes are kept.
         """
-        Stage file and commit with provided message.
+        sections = []
+        for d in diffs:
+            header = []
+            if d.new_file:
+                header.append(f"new file mode {d.b_mode:o}" if d.b_mode else "new file")
+            elif d.deleted_file:
+                header.append(f"deleted file mode {d.a_mode:o}" if d.a_mode else "deleted file")
+            elif d.a_mode and d.b_mode and d.a_mode != d.b_mode:
+                header.append(f"old mode {d.a_mode:o}\nnew mode {d.b_mode:o}")
+            if d.renamed_file:
+                header.append(f"rename from {d.rename_from}\nrename to {d.rename_to}")
+            if d.diff:
+                a_name = f"a/{d.a_path}" if d.a_path else "/dev/null"
+                b_name = f"b/{d.b_path}" if d.b_path else "/dev/null"
+                header.append(f"--- {a_name}\n+++ {b_name}\n"
+                              + d.diff.decode('utf-8', errors='replace').rstrip('\n'))
+            if not header:
+                continue
+            a_path = d.a_path or d.b_path
+            b_path = d.b_path or d.a_path
+            sections.append(f"diff --git a/{a_path} b/{b_path}\n" + "\n".join(header) + "\n")
+        return "".join(sections)
+
+    def stage_and_commit(self, filename, commit_message, staged=False):
+        """
+        Stage file (unless already staged) and commit with provided message.
         """
         try:
-            self.repo.git.add(filename)
+            if not staged:
+                self.repo.git.add(filename)
             self.repo.index.commit(commit_message)
             print(f"Committed '{filename}' with message: {commit_message}")
+            return True
         except (OSError, ValueError) as e:
             print(f"Error during commit: {e}")
+            return False
 
-    def commit_file_with_ai(self, filename, model="openai/gpt-4.1", edit=True, dry_run=False):
+    def _stage_early(self, filename):
         """
-        Main workflow: get diff, generate commit message, optionally edit, commit.
+        Stage the file ahead of its commit, unless it already has staged
+        changes (or HEAD is unborn), which an add would overwrite beyond
+        undoing. Returns True if the file was staged here.
+        """
+        if not self.repo.head.is_valid() or self.repo.index.diff('HEAD', paths=[filename]):
+            return False
+        self.repo.git.add(filename)
+        return True
+
+    def _undo_early_stage(self, filename):
+        """
+        Revert the staging done ahead of a commit that did not happen.
+        """
+        try:
+            self.repo.git.reset('-q', '--', filename)
+        except (OSError, ValueError) as e:
+            print(f"Error unstaging '{filename}', it was left staged: {e}")
+
+    async def _generate_for_file(self, filename, model, echo=True):
+        """
+        Get the diff for a file and generate its commit message.
         """
         diff_msg = self.get_diff(filename)
         if not diff_msg:
             print(f"No changes detected for '{filename}'.")
-            return
+            return None
 
-        commit_msg = self.generate_commit_message(diff_msg, model)
+        commit_msg = await self.generate_commit_message(diff_msg, model, echo=echo)
         if not commit_msg:
             print("Failed to generate commit message.")
-            return
+        return commit_msg
 
+    def _finalize_commit(self, filename, commit_msg, edit=True, dry_run=False, staged=False):
+        """
+        Optionally edit the generated commit message, then commit.
+        Returns True if a commit was made.
+        """
         if dry_run:
-            return
+            return False
 
         if edit:
-            with tempfile.NamedTemporaryFile(mode='w+', delete=False) as temp_file:
-                temp_file.write(commit_msg)
-                temp_path = Path(temp_file.name)
-
-            # get timestamp on the file
-            pre_edit_tstamp = temp_path.stat().st_mtime
-            click.edit(filename=str(temp_path))
-
-            # get timestamp after edit
-            post_edit_tstamp = temp_path.stat().st_mtime
-            
-            # if file was not modied don't commit
-            if pre_edit_tstamp == post_edit_tstamp:
+            edited = click.edit(text=commit_msg)
+
+            # if the message was not saved don't commit
+            if edited is None:
                 print("No changes were commited.")
-                return
+                return False
 
             # if commit_msg is empty don't commit
-            commit_msg = temp_path.read_text(encoding='utf-8').strip()
+            commit_msg = edited.strip()
             if not commit_msg:
                 print("No changes were commited.")
+                return False
+
+        return self.stage_and_commit(filename, commit_msg, staged=staged)
+
+    async def commit_file_with_ai(self, filename, model="openai/gpt-4.1", edit=True, dry_run=False):
+        """
+        Main workflow: get diff, generate commit message, optionally edit, commit.
+        The file is staged in a worker thread while the message is generated.
+        """
+        diff_msg = self.get_diff(filename)
+        if not diff_msg:
+            print(f"No changes detected for '{filename}'.")
+            return
+
+        # the staged-changes probe and the add both run while the model answers
+        stage_task = None
+        if not dry_run:
+            stage_task = asyncio.create_task(asyncio.to_thread(self._stage_early, filename))
+
+        commit_msg = await self.generate_commit_message(diff_msg, model)
+
+        staged = False
+        if stage_task:
+            try:
+                staged = await stage_task
+            except (OSError, ValueError) as e:
+                print(f"Error during commit: {e}")
                 return
 
-        self.stage_and_commit(filename, commit_msg)
+        if not commit_msg:
+            print("Failed to generate commit message.")
+            if staged:
+                self._undo_early_stage(filename)
+            return
+
+        committed = self._finalize_commit(filename, commit_msg, edit=edit, dry_run=dry_run,
+                                          staged=staged)
+        if staged and not committed:
+            self._undo_early_stage(filename)
+
+    async def commit_files_with_ai(self, filenames, model="openai/gpt-4.1", edit=True,
+                                   dry_run=False, max_concurrency=8):
+        """
+        Generate commit messages for several files, batched into as few
+        requests as possible (per file and concurrently in local mode), then
+        edit and commit them one at a time in the order given. Repeated
+        filenames are committed once.
+        """
+        filenames = list(dict.fromkeys(filenames))
+        if len(filenames) == 1:
+            await self.commit_file_with_ai(filenames[0], model=model, edit=edit, dry_run=dry_run)
+            return
+
+        # Concurrent streams would interleave on stdout, so messages are printed
+        # once all are ready. Files are not staged early here: each commit takes
+        # the whole index, so staging them together would merge the commits.
+        if self.local:
+            sem = asyncio.Semaphore(max_concurrency)
+
+            async def _one(filename):
+                async with sem:
+                    return await self._generate_for_file(filename, model, echo=False)
+
+            commit_msgs = await asyncio.gather(*[_one(f) for f in filenames])
+        else:
+            diffs = {}
+            for filename in filenames:
+                diff_msg = self.get_diff(filename)
+                if diff_msg:
+                    diffs[filename] = diff_msg
+                else:
+                    print(f"No changes detected for '{filename}'.")
+            messages = await self.generate_commit_messages_batch(
+                diffs, model, max_concurrency=max_concurrency)
+            for filename in diffs:
+                if not messages.get(filename):
+                    print(f"Failed to generate commit message for '{filename}'.")
+            commit_msgs = [messages.get(f) for f in filenames]
+
+        for filename, commit_msg in zip(filenames, commit_msgs):
+            if commit_msg:
+                print(f"{filename}:\n{commit_msg}\n")
+                self._finalize_commit(filename, commit_msg, edit=edit, dry_run=dry_run)
 
 
 @click.command()
-@click.argument("filename", type=click.Path(exists=True))
+@click.argument("filenames", nargs=-1, required=True, type=click.Path(exists=True))
 @click.option("--model", default="openai/gpt-4.1", help="Model to use")
 @click.option("--list-models", is_flag=True)
+@click.option("--refresh-models", is_flag=True, help="Ignore the cached model list")
 @click.option("--dry-run", is_flag=True)
+@click.option("--local", is_flag=True, help="Generate messages with a local quantized model")
+@click.option("--local-adapter", default=None, help="LoRA adapter to apply in --local mode")
 @click.option("--no-edit", is_flag=False, help="No interactive mode")
-def main(filename, model, list_models, dry_run, no_edit):
+def main(filenames, model, list_models, refresh_models, dry_run, local, local_adapter, no_edit):
     """
-    Commit changes to a file using AI-generated commit messages.
+    Commit changes to files using AI-generated commit messages.
     Arguments:
-        FILENAME: Path to the file to commit.
+        FILENAMES: Paths to the files to commit, one commit per file.
     Options:
         --model: Specify the language model to use.
         --list-models: List available models and exit.
+        --refresh-models: Refetch the model list instead of using the cache.
         --dry-run: Show the generated commit message without committing.
+        --local: Generate messages with a local quantized model instead of the API.
+        --local-adapter: LoRA adapter (path or hub id) to load in --local mode.
         --no-edit: Skip interactive editing of the commit message.
     """
-    helper = GitCommitHelper()
+    helper = GitCommitHelper(local=LocalLLM(adapter_id=local_adapter) if local else None)
+
+    if list_models and local:
+        print(f"- {LOCAL_BASE_MODEL}")
+        return
 
     if list_models:
-        for m in helper.get_models():
+        for m in _run(helper.get_models(refresh=refresh_models)):
             print(f"- {m}")
         return
 
-    helper.commit_file_with_ai(filename, model=model, edit=not no_edit, dry_run=dry_run)
+    _run(helper.commit_files_with_ai(filenames, model=model,
+                                     edit=not no_edit, dry_run=dry_run))